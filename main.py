@@ -1,13 +1,39 @@
 import os
-import requests
-import pandas as pd
+import math
+import asyncio
+import httpx
+import orjson
+import numpy as np
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from datetime import datetime
-from typing import Literal
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from _njit import HAVE_NUMBA, njit
+from typing import Literal, NamedTuple
 
-app = FastAPI()
+# Idle connections outlive the 60s klines TTL so cache refreshes reuse the TLS session.
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=10,
+    headers={"User-Agent": "crypto-backend"},
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=90),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Only serving processes pay for compiling/loading the kernels, not a supervisor.
+    if HAVE_NUMBA:
+        warm_up_kernels()
+    yield
+    await client.aclose()
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,94 +65,264 @@ BINANCE_SYMBOL_MAP = {
     "litecoin": "LTCUSDT"
 }
 
+SMA_WINDOW = 7
+EMA_SPAN = 7
+RSI_PERIOD = 14
+
+SYMBOL_INDEX = {**{coin_id: coin_id for coin_id in SYMBOL_MAP.values()}, **SYMBOL_MAP}
+
 @app.get("/")
-def root():
+async def root():
     return {"message": "Crypto backend online with Binance API"}
 
 def resolve_symbol_to_id(symbol: str):
-    symbol = symbol.lower()
-    if symbol in SYMBOL_MAP.values():
-        return symbol
-    coin_id = SYMBOL_MAP.get(symbol)
-    if not coin_id:
+    coin_id = SYMBOL_INDEX.get(symbol.lower())
+    if coin_id is None:
         raise HTTPException(status_code=404, detail="Simbolo non riconosciuto o supportato.")
     return coin_id
 
-def get_binance_klines(coin_id: str, interval: str):
+_klines_cache = TTLCache(maxsize=256, ttl=60)
+_klines_inflight = {}
+
+def utc_datetime(timestamp_ms: int):
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+class Klines(NamedTuple):
+    timestamps: np.ndarray
+    prices: np.ndarray
+    dates: list
+
+async def fetch_binance_klines(coin_id: str, interval: str):
     symbol = BINANCE_SYMBOL_MAP.get(coin_id.lower())
     if not symbol:
         raise HTTPException(status_code=400, detail=f"Coin non supportata da Binance: {coin_id}")
     url = "https://api.binance.com/api/v3/klines"
     params = {"symbol": symbol, "interval": interval, "limit": 100}
-    res = requests.get(url, params=params, timeout=10)
+    res = await client.get(url, params=params)
     res.raise_for_status()
     data = res.json()
-    return [{"timestamp": int(c[0]), "price": float(c[4])} for c in data]
+    timestamps = np.fromiter((c[0] for c in data), dtype=np.int64, count=len(data))
+    prices = np.fromiter((float(c[4]) for c in data), dtype=np.float64, count=len(data))
+    # Shared by every request that hits the cache.
+    timestamps.flags.writeable = False
+    prices.flags.writeable = False
+    dates = [utc_datetime(ts).strftime("%Y-%m-%d") for ts in timestamps.tolist()]
+    return Klines(timestamps, prices, dates)
 
-def compute_rsi(series, period=14):
-    delta = series.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
+async def get_binance_klines(coin_id: str, interval: str):
+    key = (coin_id.lower(), interval)
+    cached = _klines_cache.get(key)
+    if cached is not None:
+        return cached
+    # Concurrent misses on the same key share one upstream request.
+    task = _klines_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_binance_klines(coin_id, interval))
+        _klines_inflight[key] = task
+        task.add_done_callback(lambda _: _klines_inflight.pop(key, None))
+    klines = await asyncio.shield(task)
+    _klines_cache[key] = klines
+    return klines
 
-@app.get("/analyze")
-def analyze(symbol: str = "bitcoin", interval: Literal["1d", "7d", "30d"] = "30d"):
+@njit(cache=True, inline="always")
+def _ewm(x, alpha):
+    y = np.empty_like(x)
+    if len(x) == 0:
+        return y
+    y[0] = x[0]
+    for i in range(1, len(x)):
+        y[i] = alpha * x[i] + (1 - alpha) * y[i - 1]
+    return y
+
+@njit(cache=True, inline="always")
+def _rolling_mean_std(x, window):
+    n = len(x)
+    mean = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    if n == 0:
+        return mean, std
+    # Sums are taken around x[0] so the variance does not cancel on large prices.
+    shift = x[0]
+    s = ss = 0.0
+    for i in range(n):
+        d = x[i] - shift
+        s += d
+        ss += d * d
+        if i >= window:
+            d_old = x[i - window] - shift
+            s -= d_old
+            ss -= d_old * d_old
+        if i >= window - 1:
+            mean[i] = shift + s / window
+            var = (ss - s * s / window) / (window - 1)
+            std[i] = np.sqrt(var) if var > 0 else 0.0
+    return mean, std
+
+@njit(cache=True, inline="always")
+def _rsi(x, period):
+    out = np.full(len(x), np.nan)
+    gain_sum = loss_sum = 0.0
+    gains = losses = 0
+    for i in range(1, len(x)):
+        delta = x[i] - x[i - 1]
+        gain_sum += max(delta, 0.0)
+        loss_sum += max(-delta, 0.0)
+        gains += delta > 0
+        losses += delta < 0
+        if i >= period + 1:
+            old = x[i - period] - x[i - period - 1]
+            gain_sum -= max(old, 0.0)
+            loss_sum -= max(-old, 0.0)
+            gains -= old > 0
+            losses -= old < 0
+        # Non-zero counters keep the running sums exactly 0.0 once a window is flat.
+        if gains == 0:
+            gain_sum = 0.0
+        if losses == 0:
+            loss_sum = 0.0
+        if i >= period - 1:
+            if loss_sum > 0:
+                out[i] = 100 - (100 / (1 + gain_sum / loss_sum))
+            elif gain_sum > 0:
+                out[i] = 100.0
+    return out
+
+# numba freezes module globals, so these see the windows as compile-time constants.
+@njit(cache=True, nogil=True)
+def _sma_std_fixed(x):
+    return _rolling_mean_std(x, SMA_WINDOW)
+
+@njit(cache=True, nogil=True)
+def _ema_fixed(x):
+    return _ewm(x, 2 / (EMA_SPAN + 1))
+
+@njit(cache=True, nogil=True)
+def _rsi_fixed(x):
+    return _rsi(x, RSI_PERIOD)
+
+def warm_up_kernels():
+    # Cached klines are read-only, which numba compiles as a separate signature.
+    x = np.zeros(max(SMA_WINDOW, RSI_PERIOD) + 1)
+    x.flags.writeable = False
+    _sma_std_fixed(x)
+    _ema_fixed(x)
+    _rsi_fixed(x)
+
+def rolling_mean_std(prices, window=SMA_WINDOW):
+    if HAVE_NUMBA or len(prices) < window:
+        if window == SMA_WINDOW:
+            return _sma_std_fixed(prices)
+        return _rolling_mean_std(prices, window)
+    # Without numba the loop above is interpreted; two C convolutions are far cheaper.
+    kernel = np.full(window, 1.0 / window)
+    d = prices - prices[0]
+    mean_d = np.convolve(d, kernel, mode="valid")
+    var = (np.convolve(d * d, kernel, mode="valid") - mean_d * mean_d) * window / (window - 1)
+    mean = np.full(len(prices), np.nan)
+    std = np.full(len(prices), np.nan)
+    mean[window - 1:] = prices[0] + mean_d
+    std[window - 1:] = np.sqrt(np.maximum(var, 0.0))
+    return mean, std
+
+def finite_round(value, ndigits):
+    value = float(value)
+    return round(value, ndigits) if math.isfinite(value) else None
+
+def compute_ema(prices, span=EMA_SPAN):
+    if span == EMA_SPAN:
+        return _ema_fixed(prices)
+    return _ewm(prices, 2 / (span + 1))
+
+def compute_rsi(prices, period=RSI_PERIOD):
+    if HAVE_NUMBA or len(prices) < period:
+        if period == RSI_PERIOD:
+            return _rsi_fixed(prices)
+        return _rsi(prices, period)
+    delta = np.diff(prices, prepend=prices[:1])
+    kernel = np.ones(period)
+    gain_sum = np.convolve(np.maximum(delta, 0.0), kernel, mode="valid")
+    loss_sum = np.convolve(np.maximum(-delta, 0.0), kernel, mode="valid")
+    rsi = np.full(len(prices), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi[period - 1:] = 100 - (100 / (1 + gain_sum / loss_sum))
+    return rsi
+
+_analysis_cache = TTLCache(maxsize=256, ttl=60)
+
+async def analyze_symbol(symbol: str, interval: str):
     try:
         coin_id = resolve_symbol_to_id(symbol)
         interval_map = {"1d": "1h", "7d": "4h", "30d": "1d"}
         binance_interval = interval_map.get(interval, "1d")
-        raw_data = get_binance_klines(coin_id, binance_interval)
-
-        df = pd.DataFrame(raw_data)
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms")
-        df["price"] = df["price"].astype(float)
-        df["sma"] = df["price"].rolling(window=7).mean()
-        df["ema"] = df["price"].ewm(span=7, adjust=False).mean()
-        df["bb_upper"] = df["sma"] + 2 * df["price"].rolling(window=7).std()
-        df["bb_lower"] = df["sma"] - 2 * df["price"].rolling(window=7).std()
-        df["rsi"] = compute_rsi(df["price"])
-        df = df.dropna()
-        latest = df.iloc[-1]
-
-        return {
+        klines = await get_binance_klines(coin_id, binance_interval)
+
+        # The encoded analysis depends only on the klines, so it is reused until they are refetched.
+        key = (coin_id, interval)
+        cached = _analysis_cache.get(key)
+        if cached is not None and cached[0] is klines:
+            return cached[1]
+
+        prices = klines.prices
+        sma, std = rolling_mean_std(prices)
+        ema = compute_ema(prices)
+        bb_upper = sma + 2 * std
+        bb_lower = sma - 2 * std
+        rsi = compute_rsi(prices)
+
+        start = max(SMA_WINDOW, RSI_PERIOD) - 1
+        prices, sma, ema, bb_upper, bb_lower, rsi = (
+            a[start:] for a in (prices, sma, ema, bb_upper, bb_lower, rsi)
+        )
+        dates = klines.dates[start:]
+
+        payload = {
             "symbol": coin_id,
-            "date": str(latest["timestamp"]),
-            "price": round(latest["price"], 4),
-            "sma": round(latest["sma"], 4),
-            "ema": round(latest["ema"], 4),
-            "bb_upper": round(latest["bb_upper"], 4),
-            "bb_lower": round(latest["bb_lower"], 4),
-            "rsi": round(latest["rsi"], 2),
+            "date": str(utc_datetime(int(klines.timestamps[-1]))),
+            "price": finite_round(prices[-1], 4),
+            "sma": finite_round(sma[-1], 4),
+            "ema": finite_round(ema[-1], 4),
+            "bb_upper": finite_round(bb_upper[-1], 4),
+            "bb_lower": finite_round(bb_lower[-1], 4),
+            "rsi": finite_round(rsi[-1], 2),
             "macd": None,
             "signal": None,
-            "support": round(df["price"].min(), 2),
-            "resistance": round(df["price"].max(), 2),
+            "support": round(float(prices.min()), 2),
+            "resistance": round(float(prices.max()), 2),
             "gpt_summary": "GPT disabilitato.",
             "news": [],
             "history": {
-                "dates": df["timestamp"].dt.strftime("%Y-%m-%d").tolist(),
-                "prices": df["price"].round(2).tolist(),
-                "sma": df["sma"].round(2).tolist(),
-                "bb_upper": df["bb_upper"].round(2).tolist(),
-                "bb_lower": df["bb_lower"].round(2).tolist()
+                "dates": dates,
+                "prices": prices.round(2),
+                "sma": sma.round(2),
+                "bb_upper": bb_upper.round(2),
+                "bb_lower": bb_lower.round(2)
             }
         }
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+        _analysis_cache[key] = (klines, body)
+        return body
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"Errore Binance: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore interno: {str(e)}")
 
+@app.get("/analyze")
+async def analyze(symbol: str = "bitcoin", interval: Literal["1d", "7d", "30d"] = "30d"):
+    return Response(await analyze_symbol(symbol, interval), media_type="application/json")
+
 @app.get("/market-scan")
-def market_scan():
+async def market_scan():
     try:
         coins = ["bitcoin", "ethereum", "cardano", "dogecoin", "solana", "ripple"]
+        fetched = await asyncio.gather(*[get_binance_klines(coin, "1d") for coin in coins], return_exceptions=True)
         result = []
-        for coin in coins:
+        for coin, klines in zip(coins, fetched):
+            if isinstance(klines, BaseException):
+                continue
             try:
-                data = get_binance_klines(coin, "1d")[-2:]
-                change = ((data[-1]['price'] - data[0]['price']) / data[0]['price']) * 100
+                data = klines.prices[-2:]
+                change = float((data[-1] - data[0]) / data[0]) * 100
                 result.append({"id": coin, "name": coin.capitalize(), "symbol": coin[:3], "volatility_score": round(change, 2)})
             except:
                 continue
@@ -135,11 +331,26 @@ def market_scan():
         raise HTTPException(status_code=500, detail=f"Errore market scan: {str(e)}")
 
 @app.get("/analyze-multi")
-def analyze_multi():
-    scan = market_scan()
-    return {"analysis": [analyze(symbol=c["id"]) for c in scan.get("top_volatile", [])]}
+async def analyze_multi():
+    scan = await market_scan()
+    results = await asyncio.gather(
+        *[analyze_symbol(c["id"], "30d") for c in scan.get("top_volatile", [])],
+        return_exceptions=True,
+    )
+    bodies = [r for r in results if not isinstance(r, BaseException)]
+    return Response(b'{"analysis":[' + b",".join(bodies) + b"]}", media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+    # Each worker carries numba (~170 MB RSS), so more than one must be opted into.
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    # A single worker serves this module directly instead of importing main a second time.
+    uvicorn.run(
+        app if workers == 1 else "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8000)),
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+    )
 